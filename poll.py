@@ -131,7 +131,7 @@ class Poll:
         """Creates a new poll without any votes.
         Empty vote_options will be replaced by ['Yes', 'No'].
         """
-        con = sqlite3.connect(settings.DATABASE)
+        con = sqlite3.connect(settings.DATABASE, uri=True)
         init_database(con)
         cur = con.cursor()
 
@@ -162,7 +162,7 @@ class Poll:
         Raise a InvalidPollError if no poll with that id
         exists.
         """
-        con = sqlite3.connect(settings.DATABASE)
+        con = sqlite3.connect(settings.DATABASE, uri=True)
         return cls(con, id)
 
     def num_votes(self):
@@ -1,11 +1,14 @@
-import os.path
+import sqlite3
 import pytest
 
 import settings
 
 
 @pytest.fixture(autouse=True, scope='session')
-def clear_database():
+def keep_database_alive():
     assert settings.TEST_SETTINGS
-    if os.path.exists(settings.DATABASE):
-        os.remove(settings.DATABASE)
+    # the in-memory database only lives as long as a connection to it
+    # is open, so keep one around for the whole session
+    con = sqlite3.connect(settings.DATABASE, uri=True)
+    yield
+    con.close()
@@ -2,8 +2,9 @@
 
 TEST_SETTINGS = True
 
-# Path to the database file.
-DATABASE = 'poll_test.db'
+# Shared in-memory database, kept alive by conftest.py.
+# Every pytest-xdist worker is a separate process and gets its own copy.
+DATABASE = 'file:poll_test?mode=memory&cache=shared'
 
 # Optional Mattermost token
 MATTERMOST_TOKENS = None
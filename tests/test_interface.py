@@ -1,23 +1,77 @@
 # pylint: disable=missing-docstring
-import json
-import jsonschema
+import fastjsonschema
+import orjson
 import pytest
 import app
 import settings
 from tests import schemas
 
 
-@pytest.fixture
+# the schemas are constant, so compile their validators only once
+# (format checks are disabled like with jsonschema's default validators)
+validate_poll = fastjsonschema.compile(schemas.poll, use_formats=False)
+validate_end = fastjsonschema.compile(schemas.end, use_formats=False)
+validate_ephemeral = fastjsonschema.compile(schemas.ephemeral,
+                                            use_formats=False)
+# a vote response may contain the updated poll, check both in one pass
+validate_vote = fastjsonschema.compile({
+    '$schema': schemas.vote['$schema'],
+    'allOf': [schemas.vote, {
+        'properties': {
+            'update': {'properties': {'props': schemas.poll}}
+        }
+    }]
+}, use_formats=False)
+
+
+@pytest.fixture(scope='module')
 def base_url():
     return 'http://www.example.com:5005/'
 
 
-@pytest.fixture
+@pytest.fixture(scope='module')
 def client():
+    # the app sets no cookies or session state, so the client can be shared
     app.app.testing = True
     return app.app.test_client()
 
 
+@pytest.fixture(scope='module')
+def post_json(base_url, client):
+    """Returns a function that posts a payload as JSON to an url, like
+    Mattermost calls the actions.
+    """
+    def post(url, payload):
+        return client.post(url, data=orjson.dumps(payload),
+                           content_type='application/json',
+                           base_url=base_url)
+    return post
+
+
+def load_json(response):
+    """Returns the decoded JSON body of `response`."""
+    return orjson.loads(response.data)
+
+
+def action_targets(base_url, actions):
+    """Returns the (url, context) pair of each action, with the url
+    relative to `base_url`.
+    """
+    return [(a['integration']['url'][len(base_url):],
+             a['integration']['context']) for a in actions]
+
+
+def create_poll(client, base_url, text):
+    """Creates a new poll as 'user0' and returns its action targets."""
+    data = {
+        'user_id': 'user0',
+        'text': text
+    }
+    response = client.post('/', data=data, base_url=base_url)
+    rd = load_json(response)
+    return action_targets(base_url, rd['attachments'][0]['actions'])
+
+
 def test_status(base_url, client):
     response = client.get('/', base_url=base_url)
     assert response.status_code == 200
@@ -33,16 +87,18 @@ def __validate_reponse(base_url, response_json, message, vote_options):
     """Validates the response against the json schema expected by
     Mattermost.
     """
-    # validate the schema
-    jsonschema.validate(response_json, schemas.poll)
+    validate_poll(response_json)
+    __validate_poll_values(base_url, response_json, message, vote_options)
+
 
-    # validate the values
-    assert response_json['attachments'][0]['text'] == message
-    actions = response_json['attachments'][0]['actions']
+def __validate_poll_values(base_url, poll_json, message, vote_options):
+    """Validates the values of a poll that matches the poll schema."""
+    assert poll_json['attachments'][0]['text'] == message
+    actions = poll_json['attachments'][0]['actions']
     assert len(actions) == len(vote_options) + 1
 
     for action, vote in zip(actions[:-1], vote_options):
-        assert vote in action['name']
+        assert action['name'].startswith(vote)
         integration = action['integration']
         assert integration['url'] == base_url + 'vote'
 
@@ -53,16 +109,17 @@ def __validate_reponse(base_url, response_json, message, vote_options):
 def __validate_vote_response(base_url, response_json, message, vote_options,
                              voted_id):
     """Validates the response after a vote."""
-    jsonschema.validate(response_json, schemas.vote)
+    # also validates the schema of the updated poll
+    validate_vote(response_json)
 
     if 'update' in response_json:
         poll_json = response_json['update']['props']
-        __validate_reponse(base_url, poll_json, message, vote_options)
+        __validate_poll_values(base_url, poll_json, message, vote_options)
 
 
 def __validate_end_response(response_json, message, vote_options):
     """Validates the response when the vote ends."""
-    jsonschema.validate(response_json, schemas.end)
+    validate_end(response_json)
 
     # check if all fields are there (content of fields is
     # tested in test_app)
@@ -83,7 +140,7 @@ def test_poll(base_url, client, data, status_code, message, vote_options):
     if status_code != 200:
         return
 
-    rd = json.loads(response.data.decode('utf-8'))
+    rd = load_json(response)
     __validate_reponse(base_url, rd, message, vote_options)
 
 
@@ -96,8 +153,8 @@ def test_poll_no_message(base_url, client):
     response = client.post('/', data=data, base_url=base_url)
     assert response.status_code == 200
 
-    rd = json.loads(response.data.decode('utf-8'))
-    jsonschema.validate(rd, schemas.ephemeral)
+    rd = load_json(response)
+    validate_ephemeral(rd)
 
 
 @pytest.mark.parametrize('max_votes, votes, expected', [
@@ -110,47 +167,34 @@ def test_poll_no_message(base_url, client):
 
 ], ids=['1 vote', '3 votes', 'Changed votes', 'Multi, 3 votes',
         'Multi, unvote', 'Multi, overvote'])
-def test_vote(base_url, client, max_votes, votes, expected):
-    command = '''Message --Spam --Foo --Bar --votes={}'''.format(max_votes)
+def test_vote(base_url, client, post_json, max_votes, votes, expected):
+    command = 'Message --Spam --Foo --Bar --votes={}'.format(max_votes)
 
     # create a new poll
-    data = {
-        'user_id': 'user0',
-        'text': command
-    }
-    response = client.post('/', data=data, base_url=base_url)
-    rd = json.loads(response.data.decode('utf-8'))
-
-    actions = rd['attachments'][0]['actions']
-    assert len(actions) == 4
-    action_urls = [a['integration']['url'].replace(base_url, '')
-                   for a in actions]
-    action_contexts = [a['integration']['context'] for a in actions]
+    targets = create_poll(client, base_url, command)
+    assert len(targets) == 4
 
     # place votes by calling the url in the action with the
     # corresponding context (i.e. what Mattermost is doing)
     for user, vote in votes:
-        url = action_urls[vote]
-        context = action_contexts[vote]
-        data = json.dumps({
+        url, context = targets[vote]
+        data = {
             'user_id': user,
             'context': context
-        })
-        response = client.post(url, data=data,
-                               content_type='application/json',
-                               base_url=base_url)
+        }
+        response = post_json(url, data)
         assert response.status_code == 200
 
-        rd = json.loads(response.data.decode('utf-8'))
+        rd = load_json(response)
         __validate_vote_response(base_url, rd, 'Message',
                                  ['Spam', 'Foo', 'Bar'], vote)
 
     if 'update' in rd:
-        # check if the number of votes is contained in the actions name
+        # check if the number of votes is appended to the actions name
         actions = rd['update']['props']['attachments'][0]['actions']
         assert len(actions) == 4
         for action, num_votes in zip(actions, expected):
-            assert str(num_votes) in action['name']
+            assert action['name'].endswith('({})'.format(num_votes))
 
 
 @pytest.mark.parametrize('votes, expected', [
@@ -158,75 +202,48 @@ def test_vote(base_url, client, max_votes, votes, expected):
     ([('user0', 0), ('user1', 1), ('user2', 2)], (1, 1, 1)),
 
 ], ids=['No votes', '3 votes'])
-def test_end(base_url, client, votes, expected):
+def test_end(base_url, client, post_json, votes, expected):
     # create a new poll
-    data = {
-        'user_id': 'user0',
-        'text': 'Message --Spam --Foo --Bar'
-    }
-    response = client.post('/', data=data, base_url=base_url)
-    rd = json.loads(response.data.decode('utf-8'))
-
-    actions = rd['attachments'][0]['actions']
-    assert len(actions) == 4
-    action_urls = [a['integration']['url'].replace(base_url, '')
-                   for a in actions]
-    action_contexts = [a['integration']['context'] for a in actions]
+    targets = create_poll(client, base_url, 'Message --Spam --Foo --Bar')
+    assert len(targets) == 4
 
     # place the votes
     for user, vote in votes:
-        url = action_urls[vote]
-        context = action_contexts[vote]
-        data = json.dumps({
+        url, context = targets[vote]
+        data = {
             'user_id': user,
             'context': context
-        })
-        response = client.post(url, data=data,
-                               content_type='application/json',
-                               base_url=base_url)
+        }
+        response = post_json(url, data)
         assert response.status_code == 200
 
-    context = action_contexts[-1]
-    data = json.dumps({
+    url, context = targets[-1]
+    data = {
         'user_id': 'user0',
         'team_id': 'team0',
         'context': context
-    })
-    response = client.post(action_urls[-1], data=data,
-                           content_type='application/json',
-                           base_url=base_url)
+    }
+    response = post_json(url, data)
     assert response.status_code == 200
 
-    rd = json.loads(response.data.decode('utf-8'))
+    rd = load_json(response)
     __validate_end_response(rd, 'Message', ['Spam', 'Foo', 'Bar'])
 
 
-def test_end_wrong_user(base_url, client):
+def test_end_wrong_user(base_url, client, post_json):
     # create a new poll
-    data = {
-        'user_id': 'user0',
-        'text': 'Message'
-    }
-    response = client.post('/', data=data, base_url=base_url)
-    rd = json.loads(response.data.decode('utf-8'))
-
-    actions = rd['attachments'][0]['actions']
-    action_urls = [a['integration']['url'].replace(base_url, '')
-                   for a in actions]
-    action_contexts = [a['integration']['context'] for a in actions]
+    targets = create_poll(client, base_url, 'Message')
 
-    context = action_contexts[-1]
-    data = json.dumps({
+    url, context = targets[-1]
+    data = {
         'user_id': 'user1',
         'team_id': 'team0',
         'context': context
-    })
-    response = client.post(action_urls[-1], data=data,
-                           content_type='application/json',
-                           base_url=base_url)
+    }
+    response = post_json(url, data)
     assert response.status_code == 200
 
-    rd = json.loads(response.data.decode('utf-8'))
+    rd = load_json(response)
     assert 'update' not in rd
     assert 'ephemeral_text' in rd
     assert rd['ephemeral_text'] == 'You are not allowed to end this poll'
@@ -238,70 +255,54 @@ def patched_is_admin_user(user_id):
     return False
 
 
-def test_end_admin(mocker, base_url, client):
+def test_end_admin(mocker, base_url, client, post_json):
     mocker.patch('app.is_admin_user', new=patched_is_admin_user)
 
     # create a new poll
-    data = {
-        'user_id': 'user0',
-        'text': 'Message'
-    }
-    response = client.post('/', data=data, base_url=base_url)
-    rd = json.loads(response.data.decode('utf-8'))
+    targets = create_poll(client, base_url, 'Message')
 
-    actions = rd['attachments'][0]['actions']
-    action_urls = [a['integration']['url'].replace(base_url, '')
-                   for a in actions]
-    action_contexts = [a['integration']['context'] for a in actions]
-
-    context = action_contexts[-1]
-    data = json.dumps({
+    url, context = targets[-1]
+    data = {
         'user_id': 'user1',
         'team_id': 'team0',
         'context': context
-    })
-    response = client.post(action_urls[-1], data=data,
-                           content_type='application/json',
-                           base_url=base_url)
+    }
+    response = post_json(url, data)
     assert response.status_code == 200
 
-    rd = json.loads(response.data.decode('utf-8'))
+    rd = load_json(response)
     __validate_end_response(rd, 'Message', ['Yes', 'No'])
 
 
-def test_vote_invalid_poll(base_url, client):
-    data = json.dumps({
+def test_vote_invalid_poll(post_json):
+    data = {
         'user_id': 'user0',
         'context': {
             'poll_id': 'invalid123',
             'vote': 0
         }
-    })
-    response = client.post('/vote', data=data,
-                           content_type='application/json',
-                           base_url=base_url)
+    }
+    response = post_json('/vote', data)
     assert response.status_code == 200
 
-    rd = json.loads(response.data.decode('utf-8'))
+    rd = load_json(response)
     assert 'update' not in rd
     assert 'ephemeral_text' in rd
 
 
-def test_end_invalid_poll(base_url, client):
-    data = json.dumps({
+def test_end_invalid_poll(post_json):
+    data = {
         'user_id': 'user0',
         'team_id': 'team0',
         'context': {
             'poll_id': 'invalid123',
             'vote': 0
         }
-    })
-    response = client.post('/end', data=data,
-                           content_type='application/json',
-                           base_url=base_url)
+    }
+    response = post_json('/end', data)
     assert response.status_code == 200
 
-    rd = json.loads(response.data.decode('utf-8'))
+    rd = load_json(response)
     assert 'update' not in rd
     assert 'ephemeral_text' in rd
 
@@ -315,8 +316,8 @@ def test_help(base_url, client):
     response = client.post('/', data=data, base_url=base_url)
     assert response.status_code == 200
 
-    rd = json.loads(response.data.decode('utf-8'))
-    jsonschema.validate(rd, schemas.ephemeral)
+    rd = load_json(response)
+    validate_ephemeral(rd)
 
     assert '/foo' in rd['text']
 
@@ -329,26 +330,13 @@ def test_help(base_url, client):
     response = client.post('/', data=data, base_url=base_url)
     assert response.status_code == 200
 
-    rd = json.loads(response.data.decode('utf-8'))
+    rd = load_json(response)
     assert rd['response_type'] != 'ephemeral'
 
 
-@pytest.fixture
-def clean_token_setting(request):
-    def clean():
-        if hasattr(settings, 'MATTERMOST_TOKEN'):
-            del settings.MATTERMOST_TOKEN
-        settings.MATTERMOST_TOKENS = None
-
-    assert settings.TEST_SETTINGS
-
-    request.addfinalizer(clean)
-
-
-@pytest.mark.usefixtures('clean_token_setting')
-def test_mattermost_tokens_none(base_url, client):
+def test_mattermost_tokens_none(mocker, base_url, client):
     assert settings.TEST_SETTINGS
-    settings.MATTERMOST_TOKENS = None
+    mocker.patch.object(settings, 'MATTERMOST_TOKENS', None)
     data = {
         'user_id': 'user0',
         'text': 'Bla',
@@ -357,14 +345,13 @@ def test_mattermost_tokens_none(base_url, client):
     response = client.post('/', data=data, base_url=base_url)
     assert response.status_code == 200
 
-    rd = json.loads(response.data.decode('utf-8'))
+    rd = load_json(response)
     assert rd['response_type'] != 'ephemeral'
 
 
-@pytest.mark.usefixtures('clean_token_setting')
-def test_mattermost_tokens_valid(base_url, client):
+def test_mattermost_tokens_valid(mocker, base_url, client):
     assert settings.TEST_SETTINGS
-    settings.MATTERMOST_TOKENS = ['xyz321', 'abc123']
+    mocker.patch.object(settings, 'MATTERMOST_TOKENS', ['xyz321', 'abc123'])
     data = {
         'user_id': 'user0',
         'text': 'Bla',
@@ -373,7 +360,7 @@ def test_mattermost_tokens_valid(base_url, client):
     response = client.post('/', data=data, base_url=base_url)
     assert response.status_code == 200
 
-    rd = json.loads(response.data.decode('utf-8'))
+    rd = load_json(response)
     assert rd['response_type'] != 'ephemeral'
 
     data = {
@@ -384,14 +371,13 @@ def test_mattermost_tokens_valid(base_url, client):
     response = client.post('/', data=data, base_url=base_url)
     assert response.status_code == 200
 
-    rd = json.loads(response.data.decode('utf-8'))
+    rd = load_json(response)
     assert rd['response_type'] != 'ephemeral'
 
 
-@pytest.mark.usefixtures('clean_token_setting')
-def test_mattermost_tokens_invalid(base_url, client):
+def test_mattermost_tokens_invalid(mocker, base_url, client):
     assert settings.TEST_SETTINGS
-    settings.MATTERMOST_TOKENS = ['xyz321', 'abc123']
+    mocker.patch.object(settings, 'MATTERMOST_TOKENS', ['xyz321', 'abc123'])
     data = {
         'user_id': 'user0',
         'text': 'Bla',
@@ -400,15 +386,15 @@ def test_mattermost_tokens_invalid(base_url, client):
     response = client.post('/', data=data, base_url=base_url)
     assert response.status_code == 200
 
-    rd = json.loads(response.data.decode('utf-8'))
+    rd = load_json(response)
     assert rd['response_type'] == 'ephemeral'
     assert 'invalid token' in rd['text'].lower()
 
 
-@pytest.mark.usefixtures('clean_token_setting')
-def test_mattermost_tokens_legacy(base_url, client):
-    del settings.MATTERMOST_TOKENS
-    settings.MATTERMOST_TOKEN = 'abc123'
+def test_mattermost_tokens_legacy(mocker, base_url, client):
+    assert settings.TEST_SETTINGS
+    mocker.patch.object(settings, 'MATTERMOST_TOKENS', None)
+    mocker.patch.object(settings, 'MATTERMOST_TOKEN', 'abc123', create=True)
     data = {
         'user_id': 'user0',
         'text': 'Bla',
@@ -417,7 +403,7 @@ def test_mattermost_tokens_legacy(base_url, client):
     response = client.post('/', data=data, base_url=base_url)
     assert response.status_code == 200
 
-    rd = json.loads(response.data.decode('utf-8'))
+    rd = load_json(response)
     assert rd['response_type'] != 'ephemeral'
 
     assert settings.MATTERMOST_TOKENS == ['abc123']
@@ -46,7 +46,7 @@ def test_localized_poll(mocker, client, data, message, actions):
     response = client.post('/', data=data)
     assert response.status_code == 200
 
-    response_json = json.loads(response.data.decode('utf-8'))
+    response_json = json.loads(response.data)
 
     actual_message = response_json['attachments'][0]['text']
     assert actual_message == message
@@ -69,7 +69,7 @@ def test_create_de_vote_en(mocker, client):
     response = client.post('/', data=data)
     assert response.status_code == 200
 
-    response_json = json.loads(response.data.decode('utf-8'))
+    response_json = json.loads(response.data)
 
     actual_message = response_json['attachments'][0]['text']
     assert actual_message == 'Brezn?'
@@ -98,7 +98,7 @@ def test_create_de_vote_en(mocker, client):
     response = client.post('/vote', data=data, content_type='application/json')
     assert response.status_code == 200
 
-    response_json = json.loads(response.data.decode('utf-8'))
+    response_json = json.loads(response.data)
 
     actual_ephemeral = response_json['ephemeral_text']
     assert "Your vote has been updated" in actual_ephemeral
@@ -126,7 +126,7 @@ def test_create_de_vote_en(mocker, client):
     response = client.post('/vote', data=data, content_type='application/json')
     assert response.status_code == 200
 
-    response_json = json.loads(response.data.decode('utf-8'))
+    response_json = json.loads(response.data)
 
     actual_ephemeral = response_json['ephemeral_text']
     assert "Ihre Wahl wurde aktualisiert" in actual_ephemeral